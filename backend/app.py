@@ -1,5 +1,10 @@
 import os
 import json
+import time
+import hashlib
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
@@ -24,7 +29,12 @@ CORS(app)
 # Configuration
 UPLOAD_FOLDER = 'data/uploads'
 PROCESSED_FOLDER = 'data/processed'
+MODELS_FOLDER = 'data/models'
+SCORING_MODELS_PATH = os.path.join(MODELS_FOLDER, 'scoring_models.joblib')
+SCORING_MODELS_VERSION = 3  # Bump when the snapshot layout changes
 ALLOWED_EXTENSIONS = {'csv', 'json'}
+# A 'processing' upload older than this is treated as abandoned and can be reclaimed
+UPLOAD_CLAIM_TTL_SECONDS = int(os.environ.get('UPLOAD_CLAIM_TTL_SECONDS', 30 * 60))
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
@@ -32,6 +42,7 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 # Create directories
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+os.makedirs(MODELS_FOLDER, exist_ok=True)
 
 # Initialize Firebase Admin
 if not firebase_admin._apps:
@@ -51,6 +62,47 @@ xgboost_model = None
 autoencoder = None
 scaler = StandardScaler()
 
+# Compiled numpy snapshot of the trained models used for scoring. Each worker
+# reloads it when another worker saves a newer one
+scoring_models = None
+scoring_models_mtime = None
+scoring_models_checked_at = 0.0
+scoring_models_lock = threading.Lock()
+SCORING_MODELS_RELOAD_SECONDS = float(os.environ.get('SCORING_MODELS_RELOAD_SECONDS', 1))
+
+# Ensemble configuration
+# 'average' runs every model; 'cascade' screens with one cheap model and only
+# runs the others on claims whose screen score is near its decision boundary
+ENSEMBLE_CONFIG = {
+    'mode': os.environ.get('ENSEMBLE_MODE', 'average'),
+    'models': {
+        # linear: clip(offset + scale * raw, 0, 100)
+        # logistic: 100 / (1 + exp(-scale * (raw - center)))
+        'isolation_forest': {'weight': 1.0, 'normalization': 'linear', 'scale': -50, 'offset': 50},
+        'xgboost': {'weight': 1.0, 'normalization': 'linear', 'scale': 100, 'offset': 0},
+        'autoencoder': {'weight': 1.0, 'normalization': 'linear', 'scale': 1000, 'offset': 0},
+    },
+    'cascade': {
+        'screen_model': 'isolation_forest',
+        # Escalate claims whose screen score lies between these quantiles of
+        # the training distribution; Isolation Forest flags the top 10%
+        'escalate_quantiles': (0.80, 0.98),
+    },
+}
+
+# Quantiles of each component's training scores kept in the snapshot
+COMPONENT_QUANTILE_GRID = np.linspace(0, 1, 101)
+
+# Real-time scoring
+MAX_SCORE_BATCH_SIZE = 100
+SCORE_MICRO_BATCH_WINDOW_MS = float(os.environ.get('SCORE_MICRO_BATCH_WINDOW_MS', 0))
+SCORE_MICRO_BATCH_MAX_SIZE = int(os.environ.get('SCORE_MICRO_BATCH_MAX_SIZE', 256))
+SCORE_REQUIRED_FIELDS = [
+    'patient_age', 'patient_gender', 'service_code', 'billed_amount',
+    'allowed_amount', 'provider_specialty', 'claim_date'
+]
+SCORE_NUMERIC_FIELDS = ['patient_age', 'billed_amount', 'allowed_amount']
+
 # Repricing rules
 REPRICING_RULES = {
     '99213': 0.20,  # 20% discount
@@ -58,6 +110,13 @@ REPRICING_RULES = {
     'default': 0.15  # 15% default discount
 }
 
+# Input fields that identify a claim's content for dedup
+CLAIM_FINGERPRINT_TEXT_FIELDS = [
+    'claim_id', 'patient_id', 'patient_gender', 'service_code',
+    'provider_id', 'provider_specialty', 'claim_date'
+]
+CLAIM_FINGERPRINT_NUMERIC_FIELDS = ['patient_age', 'billed_amount', 'allowed_amount']
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -105,26 +164,293 @@ def calculate_repricing(service_code, billed_amount):
     
     return repriced_amount, discount_percent
 
+def hash_file_contents(file):
+    """Calculate SHA-256 of an uploaded file and rewind it for saving"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.stream.read(65536), b''):
+        digest.update(chunk)
+    file.stream.seek(0)
+    return digest.hexdigest()
+
+def normalize_fingerprint_text(value):
+    """Normalize a code or ID field so CSV and JSON uploads fingerprint the same"""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    # pd.read_csv parses codes like 99213 as numbers, JSON sends "99213"
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_)):
+        if float(value).is_integer():
+            return str(int(value))
+    return str(value).strip()
+
+def normalize_fingerprint_number(value):
+    """Normalize a numeric field so 100, 100.0, "100" and numpy scalars match"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(value) else value
+
+def calculate_claim_fingerprint(claim):
+    """Calculate a content fingerprint of a claim's input fields"""
+    values = [normalize_fingerprint_text(claim.get(field)) for field in CLAIM_FINGERPRINT_TEXT_FIELDS]
+    values += [normalize_fingerprint_number(claim.get(field)) for field in CLAIM_FINGERPRINT_NUMERIC_FIELDS]
+    payload = json.dumps(values, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def get_existing_fingerprints(claim_ids):
+    """Fetch stored fingerprints for the given claim IDs from Firestore"""
+    doc_refs = [db.collection('claims').document(str(claim_id)) for claim_id in set(claim_ids)]
+    fingerprints = {}
+    if not doc_refs:
+        return fingerprints
+    for snapshot in db.get_all(doc_refs, field_paths=['fingerprint']):
+        if snapshot.exists:
+            fingerprints[snapshot.id] = (snapshot.to_dict() or {}).get('fingerprint')
+    return fingerprints
+
+@firestore.transactional
+def claim_upload(transaction, upload_ref, uid):
+    """Atomically claim a file hash for processing
+    
+    Returns (claimed, previous upload record). Processed uploads and fresh
+    in-flight claims are left alone; missing, failed or stale claims are taken.
+    """
+    snapshot = upload_ref.get(transaction=transaction)
+    previous = snapshot.to_dict() if snapshot.exists else None
+    if previous:
+        status = previous.get('status')
+        if status == 'processed':
+            return False, previous
+        claim_age = time.time() - previous.get('claimed_at', 0)
+        if status == 'processing' and claim_age < UPLOAD_CLAIM_TTL_SECONDS:
+            return False, previous
+    
+    transaction.set(upload_ref, {
+        'file_hash': upload_ref.id,
+        'status': 'processing',
+        'claimed_at': time.time(),
+        'uploaded_by': uid,
+        'upload_timestamp': datetime.now().isoformat()
+    })
+    return True, previous
+
+def parse_claim_date(value):
+    """Parse a claim date into a datetime, or None if missing or invalid"""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, datetime):
+        return None if pd.isna(value) else value
+    try:
+        return datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+
+def claim_feature_vector(claim):
+    """Build the ML feature vector for a single claim"""
+    claim_date = parse_claim_date(claim.get('claim_date'))
+    return [
+        float(claim['patient_age']),
+        1 if claim['patient_gender'] == 'M' else 0,
+        float(claim['billed_amount']),
+        float(claim['allowed_amount']),
+        len(str(claim['service_code'])),  # Service code length as feature
+        claim_date.day if claim_date else 0,
+        claim_date.month if claim_date else 0,
+    ]
+
 def prepare_features(df):
     """Prepare features for ML models"""
-    features = []
-    for _, row in df.iterrows():
-        feature_vector = [
-            row['patient_age'],
-            1 if row['patient_gender'] == 'M' else 0,
-            row['billed_amount'],
-            row['allowed_amount'],
-            len(str(row['service_code'])),  # Service code length as feature
-            row['claim_date'].day if pd.notna(row['claim_date']) else 0,
-            row['claim_date'].month if pd.notna(row['claim_date']) else 0,
-        ]
-        features.append(feature_vector)
-    
-    return np.array(features)
+    features = [claim_feature_vector(claim) for claim in df.to_dict('records')]
+    return np.array(features, dtype=np.float64)
+
+def average_path_length(n_samples):
+    """Average path length of an unsuccessful BST search, as used by Isolation Forest"""
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    lengths = np.zeros_like(n_samples)
+    lengths[n_samples == 2] = 1.0
+    mask = n_samples > 2
+    n = n_samples[mask]
+    lengths[mask] = 2.0 * (np.log(n - 1.0) + np.euler_gamma) - 2.0 * (n - 1.0) / n
+    return lengths
+
+def compile_isolation_forest(model):
+    """Flatten Isolation Forest trees into padded arrays for vectorized traversal"""
+    trees = [estimator.tree_ for estimator in model.estimators_]
+    n_trees = len(trees)
+    max_nodes = max(tree.node_count for tree in trees)
+    
+    feature = np.zeros((n_trees, max_nodes), dtype=np.intp)
+    threshold = np.zeros((n_trees, max_nodes), dtype=np.float64)
+    left = np.zeros((n_trees, max_nodes), dtype=np.intp)
+    right = np.zeros((n_trees, max_nodes), dtype=np.intp)
+    path_length = np.zeros((n_trees, max_nodes), dtype=np.float64)
+    
+    for i, tree in enumerate(trees):
+        node_count = tree.node_count
+        nodes = np.arange(node_count)
+        is_leaf = tree.children_left[:node_count] == -1
+        
+        # Node depths; sklearn stores parents before their children
+        depth = np.zeros(node_count)
+        for node in nodes[~is_leaf]:
+            depth[tree.children_left[node]] = depth[node] + 1
+            depth[tree.children_right[node]] = depth[node] + 1
+        
+        # Leaves point to themselves so a fixed-depth traversal stays put
+        feature[i, :node_count] = np.where(is_leaf, 0, tree.feature[:node_count])
+        threshold[i, :node_count] = tree.threshold[:node_count]
+        left[i, :node_count] = np.where(is_leaf, nodes, tree.children_left[:node_count])
+        right[i, :node_count] = np.where(is_leaf, nodes, tree.children_right[:node_count])
+        path_length[i, :node_count] = depth + average_path_length(tree.n_node_samples[:node_count])
+    
+    return {
+        'feature': feature,
+        'threshold': threshold,
+        'left': left,
+        'right': right,
+        'path_length': path_length,
+        'max_depth': max(tree.max_depth for tree in trees),
+        'denominator': n_trees * average_path_length([model.max_samples_])[0],
+        'offset': model.offset_,
+    }
+
+def isolation_forest_decision(compiled, X):
+    """Equivalent of IsolationForest.decision_function on compiled trees"""
+    # sklearn trees compare float32 inputs against their thresholds
+    X = X.astype(np.float32)
+    n_trees = compiled['feature'].shape[0]
+    rows = np.arange(X.shape[0])[:, None]
+    trees = np.arange(n_trees)[None, :]
+    node = np.zeros((X.shape[0], n_trees), dtype=np.intp)
+    for _ in range(compiled['max_depth']):
+        values = X[rows, compiled['feature'][trees, node]]
+        go_left = values <= compiled['threshold'][trees, node]
+        node = np.where(go_left, compiled['left'][trees, node], compiled['right'][trees, node])
+    depths = compiled['path_length'][trees, node].sum(axis=1)
+    # Same guard as sklearn for forests fit on a single sample
+    denominator = compiled['denominator']
+    normalized_depths = np.divide(
+        depths, denominator, out=np.ones_like(depths), where=denominator != 0
+    )
+    scores = -(2.0 ** (-normalized_depths))
+    return scores - compiled['offset']
+
+DENSE_ACTIVATIONS = {
+    'relu': lambda x: np.maximum(x, 0.0),
+    'sigmoid': lambda x: 1.0 / (1.0 + np.exp(-x)),
+    'linear': lambda x: x,
+}
+
+def compile_autoencoder(model):
+    """Extract Dense layer weights so the autoencoder can run in numpy"""
+    layers = []
+    for layer in model.layers:
+        if isinstance(layer, Dense):
+            weights, bias = layer.get_weights()
+            activation = layer.get_config()['activation']
+            if activation not in DENSE_ACTIVATIONS:
+                raise ValueError(f'Unsupported activation: {activation}')
+            layers.append((weights.astype(np.float64), bias.astype(np.float64), activation))
+    return layers
+
+def autoencoder_reconstruct(layers, X):
+    """Forward pass of the compiled autoencoder"""
+    output = X
+    for weights, bias, activation in layers:
+        output = DENSE_ACTIVATIONS[activation](output @ weights + bias)
+    return output
+
+def build_scoring_models(X_scaled):
+    """Compile the trained models into a numpy-only snapshot for scoring"""
+    if isolation_forest is None and xgboost_model is None and autoencoder is None:
+        return None
+    
+    models = {
+        'version': SCORING_MODELS_VERSION,
+        'scaler_mean': scaler.mean_.copy(),
+        'scaler_scale': scaler.scale_.copy(),
+        'isolation_forest': compile_isolation_forest(isolation_forest) if isolation_forest is not None else None,
+        'xgboost': xgboost_model.get_booster() if xgboost_model is not None else None,
+        'autoencoder': compile_autoencoder(autoencoder) if autoencoder is not None else None,
+        'trained_at': datetime.now().isoformat(),
+    }
+    
+    # Training distribution of each component: the mean stands in for models
+    # a cascade skips, the quantiles calibrate the escalation band
+    models['component_stats'] = {}
+    for name, model_config in ENSEMBLE_CONFIG['models'].items():
+        if models.get(name) is None:
+            continue
+        component = normalize_model_score(MODEL_RAW_SCORERS[name](models, X_scaled), model_config)
+        models['component_stats'][name] = {
+            'mean': float(np.nanmean(component)),
+            'quantiles': np.nanquantile(component, COMPONENT_QUANTILE_GRID),
+        }
+    return models
+
+def save_scoring_models(models):
+    """Persist the scoring snapshot so it is preloaded on startup"""
+    # Write to a temp file and swap it in so readers never see a partial file
+    temp_path = f"{SCORING_MODELS_PATH}.{os.getpid()}.tmp"
+    try:
+        joblib.dump(models, temp_path)
+        os.replace(temp_path, SCORING_MODELS_PATH)
+    except Exception as e:
+        print(f"Failed to save scoring models: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def scoring_models_file_mtime():
+    """Modification time of the saved snapshot, or None if there is none"""
+    try:
+        return os.stat(SCORING_MODELS_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def current_scoring_models():
+    """Return the scoring snapshot, reloading it if a newer one was saved"""
+    global scoring_models, scoring_models_mtime, scoring_models_checked_at
+    if time.monotonic() - scoring_models_checked_at < SCORING_MODELS_RELOAD_SECONDS:
+        return scoring_models
+    # Never block scoring on a reload already in progress in another thread
+    if not scoring_models_lock.acquire(blocking=False):
+        return scoring_models
+    try:
+        scoring_models_checked_at = time.monotonic()
+        mtime = scoring_models_file_mtime()
+        if mtime is not None and mtime != scoring_models_mtime:
+            models = load_scoring_models()
+            if models is not None:
+                scoring_models = models
+            scoring_models_mtime = mtime
+    finally:
+        scoring_models_lock.release()
+    return scoring_models
+
+def load_scoring_models():
+    """Load the persisted scoring snapshot, if any"""
+    if not os.path.exists(SCORING_MODELS_PATH):
+        return None
+    try:
+        models = joblib.load(SCORING_MODELS_PATH)
+    except Exception as e:
+        print(f"Failed to load scoring models: {e}")
+        return None
+    if not isinstance(models, dict) or models.get('version') != SCORING_MODELS_VERSION:
+        print("Discarding scoring models saved with an outdated layout; retrain to rebuild")
+        return None
+    missing = [
+        name for name in ENSEMBLE_CONFIG['models']
+        if models.get(name) is not None and name not in models['component_stats']
+    ]
+    if missing:
+        print(f"Scoring models lack calibration for {', '.join(missing)}; "
+              "cascade will run them on every claim until retrained")
+    return models
 
 def train_ml_models(df):
     """Train ML models for anomaly detection"""
-    global isolation_forest, xgboost_model, autoencoder, scaler
+    global isolation_forest, xgboost_model, autoencoder, scaler, scoring_models, scoring_models_mtime
     
     # Prepare features
     X = prepare_features(df)
@@ -141,9 +467,13 @@ def train_ml_models(df):
         if flags:
             y_weak[i] = 1
     
-    if np.sum(y_weak) > 0:
+    # XGBoost needs both classes present
+    if 0 < np.sum(y_weak) < len(y_weak):
         xgboost_model = xgb.XGBClassifier(random_state=42)
         xgboost_model.fit(X_scaled, y_weak)
+    else:
+        # A model fit on a previous scaler would score garbage; leave it out
+        xgboost_model = None
     
     # Train Autoencoder
     input_dim = X_scaled.shape[1]
@@ -156,32 +486,250 @@ def train_ml_models(df):
     autoencoder = Model(input_layer, decoded)
     autoencoder.compile(optimizer=Adam(learning_rate=0.001), loss='mse')
     autoencoder.fit(X_scaled, X_scaled, epochs=50, batch_size=32, verbose=0)
+    
+    # Swap in the new scoring snapshot in a single assignment
+    models = build_scoring_models(X_scaled)
+    if models is not None:
+        save_scoring_models(models)
+        scoring_models_mtime = scoring_models_file_mtime()
+    scoring_models = models
 
-def calculate_ml_risk_score(claim):
-    """Calculate ML-based risk score"""
-    if isolation_forest is None or xgboost_model is None or autoencoder is None:
-        return 50  # Default score if models not trained
+def isolation_forest_raw_score(models, X_scaled):
+    return isolation_forest_decision(models['isolation_forest'], X_scaled)
+
+def xgboost_raw_score(models, X_scaled):
+    return np.asarray(models['xgboost'].inplace_predict(X_scaled), dtype=np.float64)
+
+def autoencoder_raw_score(models, X_scaled):
+    reconstructed = autoencoder_reconstruct(models['autoencoder'], X_scaled)
+    return np.mean(np.square(X_scaled - reconstructed), axis=1)
+
+# Raw score functions for each ensemble member, cheapest first
+MODEL_RAW_SCORERS = {
+    'isolation_forest': isolation_forest_raw_score,
+    'xgboost': xgboost_raw_score,
+    'autoencoder': autoencoder_raw_score,
+}
+
+def normalize_model_score(raw, model_config):
+    """Map a model's raw output onto a 0-100 risk scale"""
+    if model_config['normalization'] == 'logistic':
+        return 100.0 / (1.0 + np.exp(-model_config['scale'] * (raw - model_config['center'])))
+    return np.clip(model_config['offset'] + model_config['scale'] * raw, 0, 100)
+
+def validate_ensemble_config(config):
+    """Raise ValueError if the ensemble configuration is invalid"""
+    if config['mode'] not in ('average', 'cascade'):
+        raise ValueError(f"Unknown ensemble mode: {config['mode']}")
+    if not config['models']:
+        raise ValueError('Ensemble must include at least one model')
+    for name, model_config in config['models'].items():
+        if name not in MODEL_RAW_SCORERS:
+            raise ValueError(f'Unknown ensemble model: {name}')
+        if model_config['weight'] < 0:
+            raise ValueError(f'Weight for {name} must be non-negative')
+        if model_config['normalization'] == 'logistic':
+            required = ('scale', 'center')
+        elif model_config['normalization'] == 'linear':
+            required = ('scale', 'offset')
+        else:
+            raise ValueError(f"Unknown normalization for {name}: {model_config['normalization']}")
+        missing = [key for key in required if key not in model_config]
+        if missing:
+            raise ValueError(f"Missing {', '.join(missing)} for {name}")
+    if config['mode'] == 'cascade':
+        screen_model = config['cascade']['screen_model']
+        if screen_model not in config['models']:
+            raise ValueError('Cascade screen model must be part of the ensemble')
+        if config['models'][screen_model]['weight'] <= 0:
+            raise ValueError('Cascade screen model must have a positive weight')
+        low, high = config['cascade']['escalate_quantiles']
+        if not 0 <= low <= high <= 1:
+            raise ValueError('Cascade escalate_quantiles must satisfy 0 <= low <= high <= 1')
+
+def weighted_ensemble(scores, active, config, models, skipped):
+    """Weighted average of component scores
     
-    # Prepare features
-    features = prepare_features(pd.DataFrame([claim]))
-    features_scaled = scaler.transform(features)
+    Where the cascade skipped a model (`skipped` is a per-claim mask), its
+    training-set mean is used instead; a model without a stored mean is left
+    out of those claims' average. NaN from a model that did run propagates.
+    """
+    components = np.vstack([scores[name] for name in active])
+    weights = np.array([config['models'][name]['weight'] for name in active])[:, None]
+    weights = np.repeat(weights, components.shape[1], axis=1)
+    for i, name in enumerate(active):
+        if not skipped[i].any():
+            continue
+        stats = models['component_stats'].get(name)
+        if stats is None:
+            weights[i, skipped[i]] = 0.0
+        else:
+            components[i, skipped[i]] = stats['mean']
+    weighted = np.where(weights > 0, components * weights, 0.0)
+    return np.clip(weighted.sum(axis=0) / weights.sum(axis=0), 0, 100)
+
+def score_feature_matrix(X, config=None):
+    """Calculate ensemble and per-model risk scores for a matrix of raw claim features
     
-    # Isolation Forest score
-    iso_score = isolation_forest.decision_function(features_scaled)[0]
-    iso_normalized = max(0, min(100, (1 - iso_score) * 50))
+    Returns a dict of arrays keyed by 'ensemble' and each configured model name.
+    Component scores are NaN where a model was not run for that claim; the
+    ensemble substitutes that model's training-set mean so every claim is
+    scored on the same scale.
+    """
+    config = config or ENSEMBLE_CONFIG
+    models = current_scoring_models()
+    n_claims = X.shape[0]
+    scores = {name: np.full(n_claims, np.nan) for name in config['models']}
+    scores['ensemble'] = np.full(n_claims, 50.0)  # Default score if models not trained
+    if models is None:
+        return scores
     
-    # XGBoost score
-    xgb_proba = xgboost_model.predict_proba(features_scaled)[0][1]
-    xgb_normalized = xgb_proba * 100
+    # Models that are both configured and trained
+    active = [
+        name for name, model_config in config['models'].items()
+        if model_config['weight'] > 0 and models.get(name) is not None
+    ]
+    if not active:
+        return scores
     
-    # Autoencoder reconstruction error
-    reconstructed = autoencoder.predict(features_scaled, verbose=0)
-    reconstruction_error = np.mean(np.square(features_scaled - reconstructed))
-    ae_normalized = min(100, reconstruction_error * 1000)
+    X_scaled = (X - models['scaler_mean']) / models['scaler_scale']
+    escalated = np.ones(n_claims, dtype=bool)
+    screened = None
     
-    # Ensemble score
-    ensemble_score = (iso_normalized + xgb_normalized + ae_normalized) / 3
-    return min(100, max(0, ensemble_score))
+    # Cascade: only claims whose screen score falls inside the calibrated
+    # band around the screen model's decision boundary go to the other models
+    screen_model = config['cascade']['screen_model']
+    if config['mode'] == 'cascade' and screen_model in active:
+        scores[screen_model] = normalize_model_score(
+            MODEL_RAW_SCORERS[screen_model](models, X_scaled),
+            config['models'][screen_model]
+        )
+        screened = screen_model
+        stats = models['component_stats'].get(screen_model)
+        if stats is not None:
+            low, high = np.interp(
+                config['cascade']['escalate_quantiles'],
+                COMPONENT_QUANTILE_GRID, stats['quantiles']
+            )
+            escalated = (scores[screen_model] >= low) & (scores[screen_model] <= high)
+    
+    rows = np.flatnonzero(escalated)
+    for name in active:
+        if name == screened or rows.size == 0:
+            continue
+        scores[name][rows] = normalize_model_score(
+            MODEL_RAW_SCORERS[name](models, X_scaled[rows]),
+            config['models'][name]
+        )
+    
+    skipped = np.vstack([
+        np.zeros(n_claims, dtype=bool) if name == screened else ~escalated
+        for name in active
+    ])
+    scores['ensemble'] = weighted_ensemble(scores, active, config, models, skipped)
+    return scores
+
+def component_scores(scores, index):
+    """Per-model scores for one claim, with None for models that did not run"""
+    return {
+        name: None if np.isnan(values[index]) else float(values[index])
+        for name, values in scores.items() if name != 'ensemble'
+    }
+
+def calculate_ml_risk_score(claim):
+    """Calculate ML-based risk score and per-model component scores"""
+    features = np.array([claim_feature_vector(claim)], dtype=np.float64)
+    scores = score_feature_matrix(features)
+    return float(scores['ensemble'][0]), component_scores(scores, 0)
+
+class MicroBatcher:
+    """Coalesce concurrent scoring requests into a single forward pass"""
+    
+    def __init__(self, score_fn, window_ms, max_batch_size):
+        self.score_fn = score_fn
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+    
+    def score(self, X, timeout=5.0):
+        future = Future()
+        self.requests.put((X, future))
+        return future.result(timeout=timeout)
+    
+    def _collect(self):
+        batch = [self.requests.get()]
+        size = batch[0][0].shape[0]
+        deadline = time.perf_counter() + self.window
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += item[0].shape[0]
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                scores = self.score_fn(np.vstack([X for X, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            
+            offset = 0
+            for X, future in batch:
+                future.set_result({
+                    name: values[offset:offset + X.shape[0]]
+                    for name, values in scores.items()
+                })
+                offset += X.shape[0]
+
+micro_batcher = None
+micro_batcher_lock = threading.Lock()
+
+def get_micro_batcher():
+    """Lazily start the micro-batcher so each worker process gets its own thread"""
+    global micro_batcher
+    if micro_batcher is None:
+        with micro_batcher_lock:
+            if micro_batcher is None:
+                micro_batcher = MicroBatcher(
+                    score_feature_matrix,
+                    SCORE_MICRO_BATCH_WINDOW_MS,
+                    SCORE_MICRO_BATCH_MAX_SIZE
+                )
+    return micro_batcher
+
+def validate_score_claim(claim):
+    """Validate a claim submitted for real-time scoring, returning an error or None"""
+    if not isinstance(claim, dict):
+        return 'Each claim must be a JSON object'
+    missing = [field for field in SCORE_REQUIRED_FIELDS if claim.get(field) is None]
+    if missing:
+        return f"Missing required fields: {', '.join(missing)}"
+    for field in SCORE_NUMERIC_FIELDS:
+        if isinstance(claim[field], bool) or not isinstance(claim[field], (int, float)):
+            return f'Field {field} must be a number'
+        # Flask's JSON parser accepts NaN and Infinity
+        if not np.isfinite(claim[field]):
+            return f'Field {field} must be finite'
+    if parse_claim_date(claim['claim_date']) is None:
+        return 'Field claim_date must be an ISO date (YYYY-MM-DD)'
+    return None
+
+validate_ensemble_config(ENSEMBLE_CONFIG)
+
+# Preload the last trained model set
+scoring_models_mtime = scoring_models_file_mtime()
+scoring_models = load_scoring_models()
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -208,14 +756,38 @@ def upload_claims():
         return jsonify({'error': 'No file selected'}), 400
     
     if file and allowed_file(file.filename):
+        # Claim the file hash atomically so identical or concurrent
+        # re-uploads are skipped
+        file_hash = hash_file_contents(file)
+        upload_ref = db.collection('uploads').document(file_hash)
+        claimed, previous = claim_upload(db.transaction(), upload_ref, user['uid'])
+        if not claimed and previous.get('status') == 'processing':
+            return jsonify({
+                'error': 'File is already being processed',
+                'duplicate': True,
+                'status': 'processing',
+                'file_hash': file_hash
+            }), 409
+        if not claimed:
+            return jsonify({
+                'message': 'File already processed',
+                'duplicate': True,
+                'status': 'processed',
+                'file_hash': file_hash,
+                'filename': previous.get('filename'),
+                'processed_count': 0,
+                'skipped_count': previous.get('total_count', 0),
+                'processed_file': previous.get('processed_file')
+            })
+        
         filename = secure_filename(file.filename)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"{timestamp}_{filename}"
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
         
         # Process the file
         try:
+            file.save(filepath)
             if filename.endswith('.csv'):
                 df = pd.read_csv(filepath)
             else:
@@ -223,11 +795,25 @@ def upload_claims():
                     data = json.load(f)
                 df = pd.DataFrame(data)
             
+            # Look up fingerprints of claims we've already stored
+            existing_fingerprints = get_existing_fingerprints(
+                str(claim_id) for claim_id in df['claim_id']
+            )
+            
             # Process claims
             processed_claims = []
+            skipped_count = 0
             for _, row in df.iterrows():
                 claim = row.to_dict()
                 
+                # Only rescore new or changed claims
+                fingerprint = calculate_claim_fingerprint(claim)
+                claim_key = str(claim['claim_id'])
+                if existing_fingerprints.get(claim_key) == fingerprint:
+                    skipped_count += 1
+                    continue
+                existing_fingerprints[claim_key] = fingerprint
+                
                 # Apply rules-based detection
                 flags = apply_rules_based_detection(claim)
                 
@@ -237,7 +823,7 @@ def upload_claims():
                 )
                 
                 # Calculate ML risk score
-                ml_risk_score = calculate_ml_risk_score(claim)
+                ml_risk_score, model_scores = calculate_ml_risk_score(claim)
                 
                 processed_claim = {
                     'claim_id': claim['claim_id'],
@@ -254,39 +840,118 @@ def upload_claims():
                     'claim_date': claim['claim_date'],
                     'rules_flags': flags,
                     'ml_risk_score': ml_risk_score,
+                    'model_scores': model_scores,
+                    'fingerprint': fingerprint,
                     'status': 'processed',
                     'upload_timestamp': datetime.now().isoformat()
                 }
                 processed_claims.append(processed_claim)
             
-            # Save processed data
-            processed_df = pd.DataFrame(processed_claims)
-            processed_filename = f"processed_{filename}"
-            processed_filepath = os.path.join(PROCESSED_FOLDER, processed_filename)
-            processed_df.to_csv(processed_filepath, index=False)
-            
-            # Store in Firestore
-            batch = db.batch()
-            for claim in processed_claims:
-                doc_ref = db.collection('claims').document(claim['claim_id'])
-                batch.set(doc_ref, claim)
-            batch.commit()
+            processed_filename = None
+            if processed_claims:
+                # Retrain on the full file before storing fingerprints, so a
+                # failed retrain is redone when the file is retried
+                train_ml_models(df)
+                
+                # Save processed data
+                processed_df = pd.DataFrame(processed_claims)
+                processed_filename = f"processed_{filename}"
+                processed_filepath = os.path.join(PROCESSED_FOLDER, processed_filename)
+                processed_df.to_csv(processed_filepath, index=False)
+                
+                # Store in Firestore
+                batch = db.batch()
+                for claim in processed_claims:
+                    doc_ref = db.collection('claims').document(claim['claim_id'])
+                    batch.set(doc_ref, claim)
+                batch.commit()
             
-            # Train models on new data
-            train_ml_models(processed_df)
+            # Record the upload so identical re-uploads are skipped
+            upload_ref.set({
+                'file_hash': file_hash,
+                'status': 'processed',
+                'filename': filename,
+                'processed_file': processed_filename,
+                'processed_count': len(processed_claims),
+                'skipped_count': skipped_count,
+                'total_count': len(processed_claims) + skipped_count,
+                'uploaded_by': user['uid'],
+                'upload_timestamp': datetime.now().isoformat()
+            })
             
             return jsonify({
                 'message': 'File processed successfully',
+                'duplicate': False,
+                'file_hash': file_hash,
                 'filename': filename,
                 'processed_count': len(processed_claims),
+                'skipped_count': skipped_count,
                 'processed_file': processed_filename
             })
             
         except Exception as e:
+            # Mark the claim failed so the file can be uploaded again
+            try:
+                upload_ref.set({
+                    'file_hash': file_hash,
+                    'status': 'failed',
+                    'error': str(e),
+                    'upload_timestamp': datetime.now().isoformat()
+                })
+            except Exception as release_error:
+                print(f"Failed to release upload {file_hash}: {release_error}")
             return jsonify({'error': f'Processing failed: {str(e)}'}), 500
     
     return jsonify({'error': 'Invalid file type'}), 400
 
+@app.route('/api/claims/score', methods=['POST'])
+def score_claims():
+    user = authenticate_request()
+    if not user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    payload = request.get_json(silent=True)
+    single = isinstance(payload, dict)
+    claims = [payload] if single else payload
+    if not isinstance(claims, list) or not claims:
+        return jsonify({'error': 'Expected a claim object or a non-empty array of claims'}), 400
+    if len(claims) > MAX_SCORE_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_SCORE_BATCH_SIZE} claims can be scored per request'}), 400
+    
+    for i, claim in enumerate(claims):
+        error = validate_score_claim(claim)
+        if error:
+            return jsonify({'error': f'Claim {i}: {error}'}), 400
+    
+    # Score all claims in one vectorized pass, without persisting anything
+    features = np.array([claim_feature_vector(claim) for claim in claims], dtype=np.float64)
+    if SCORE_MICRO_BATCH_WINDOW_MS > 0:
+        try:
+            scores = get_micro_batcher().score(features)
+        except FutureTimeoutError:
+            return jsonify({'error': 'Scoring timed out, please retry'}), 503
+    else:
+        scores = score_feature_matrix(features)
+    
+    results = []
+    for i, claim in enumerate(claims):
+        claim = dict(claim, service_code=str(claim['service_code']))
+        repriced_amount, discount_percent = calculate_repricing(
+            claim['service_code'], claim['billed_amount']
+        )
+        results.append({
+            'claim_id': claim.get('claim_id'),
+            'rules_flags': apply_rules_based_detection(claim),
+            'repriced_amount': repriced_amount,
+            'discount_percent': discount_percent,
+            'ml_risk_score': float(scores['ensemble'][i]),
+            'model_scores': component_scores(scores, i)
+        })
+    
+    if single:
+        return jsonify(results[0])
+    return jsonify({'results': results})
+
 @app.route('/api/claims', methods=['GET'])
 def get_claims():
     user = authenticate_request()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Parity and latency checks for the compiled real-time scoring models
+"""
+
+import time
+import numpy as np
+import pandas as pd
+
+import app as backend
+from generate_synthetic_data import generate_synthetic_claims
+
+# Configuration
+NUM_CLAIMS = 1000
+TOLERANCE = 1e-4
+LATENCY_RUNS = 1000
+LATENCY_P99_MS = 10.0
+ESCALATION_TOLERANCE = 0.05
+MAX_ESCALATED_FRACTION = 0.3
+COST_RUNS = 20
+
+def train_on_synthetic_data():
+    """Train models on synthetic claims and return scaled features"""
+    df = pd.DataFrame(generate_synthetic_claims(NUM_CLAIMS))
+    backend.train_ml_models(df)
+    X = backend.prepare_features(df)
+    return df, X, backend.scaler.transform(X)
+
+def report_difference(name, expected, actual):
+    """Print and check the max absolute difference between two arrays"""
+    difference = np.max(np.abs(np.asarray(expected) - np.asarray(actual)))
+    print(f"{name} max abs difference: {difference:.2e}")
+    return difference <= TOLERANCE
+
+def test_isolation_forest_parity(X_scaled):
+    """Compiled Isolation Forest matches decision_function"""
+    print("\nTesting Isolation Forest parity...")
+    expected = backend.isolation_forest.decision_function(X_scaled)
+    actual = backend.isolation_forest_decision(backend.scoring_models['isolation_forest'], X_scaled)
+    return report_difference('Isolation Forest', expected, actual)
+
+def test_xgboost_parity(X_scaled):
+    """inplace_predict matches predict_proba"""
+    print("\nTesting XGBoost parity...")
+    if backend.xgboost_model is None:
+        print("XGBoost not trained on this dataset")
+        return False
+    expected = backend.xgboost_model.predict_proba(X_scaled)[:, 1]
+    actual = backend.xgboost_raw_score(backend.scoring_models, X_scaled)
+    return report_difference('XGBoost', expected, actual)
+
+def test_autoencoder_parity(X_scaled):
+    """Numpy autoencoder matches Keras predict"""
+    print("\nTesting autoencoder parity...")
+    expected = backend.autoencoder.predict(X_scaled, verbose=0)
+    actual = backend.autoencoder_reconstruct(backend.scoring_models['autoencoder'], X_scaled)
+    return report_difference('Autoencoder', expected, actual)
+
+def test_single_sample_forest():
+    """A forest fit on one sample scores without NaN"""
+    print("\nTesting single-sample Isolation Forest...")
+    X = np.zeros((1, 7))
+    model = backend.IsolationForest(random_state=42).fit(X)
+    scores = backend.isolation_forest_decision(backend.compile_isolation_forest(model), X)
+    print(f"Score: {scores[0]}")
+    return not np.isnan(scores).any() and report_difference(
+        'Single-sample forest', model.decision_function(X), scores
+    )
+
+def cascade_config(**cascade):
+    """ENSEMBLE_CONFIG in cascade mode with optional cascade overrides"""
+    config = dict(backend.ENSEMBLE_CONFIG, mode='cascade')
+    config['cascade'] = dict(config['cascade'], **cascade)
+    return config
+
+def escalated_mask(config, scores):
+    """Claims the cascade sent past the screen model"""
+    screen_model = config['cascade']['screen_model']
+    others = [name for name in config['models'] if name != screen_model]
+    return ~np.isnan(scores[others[0]])
+
+def test_cascade_escalation(X):
+    """Cascade escalates only claims inside the calibrated band, at the expected rate"""
+    print("\nTesting cascade escalation...")
+    config = cascade_config()
+    scores = backend.score_feature_matrix(X, config)
+    escalated = escalated_mask(config, scores)
+
+    screen_model = config['cascade']['screen_model']
+    low_quantile, high_quantile = config['cascade']['escalate_quantiles']
+    stats = backend.scoring_models['component_stats']
+    low, high = np.interp(
+        [low_quantile, high_quantile], backend.COMPONENT_QUANTILE_GRID,
+        stats[screen_model]['quantiles']
+    )
+    screen = scores[screen_model]
+    in_band = (screen >= low) & (screen <= high)
+
+    fraction = escalated.mean()
+    expected = high_quantile - low_quantile
+    print(f"Screen band: [{low:.1f}, {high:.1f}]")
+    print(f"Escalated {escalated.sum()}/{len(X)} claims ({fraction:.1%}, expected ~{expected:.1%})")
+
+    # Non-escalated claims score from the screen model plus training means
+    weights = {name: model_config['weight'] for name, model_config in config['models'].items()}
+    expected_short_circuit = sum(
+        weights[name] * (screen if name == screen_model else stats[name]['mean'])
+        for name in weights
+    ) / sum(weights.values())
+    short_circuited = ~escalated
+
+    return (
+        np.array_equal(escalated, in_band)
+        and abs(fraction - expected) <= ESCALATION_TOLERANCE
+        and fraction <= MAX_ESCALATED_FRACTION
+        and report_difference(
+            'Short-circuited ensemble',
+            np.clip(expected_short_circuit[short_circuited], 0, 100),
+            scores['ensemble'][short_circuited]
+        )
+    )
+
+def test_cascade_all_escalated(X):
+    """A band covering the whole distribution reproduces average mode"""
+    print("\nTesting fully escalated cascade...")
+    config = cascade_config(escalate_quantiles=(0.0, 1.0))
+    cascade = backend.score_feature_matrix(X, config)
+    average = backend.score_feature_matrix(X, dict(backend.ENSEMBLE_CONFIG, mode='average'))
+    escalated = escalated_mask(config, cascade)
+    print(f"Escalated {escalated.sum()}/{len(X)} claims")
+    return escalated.all() and report_difference(
+        'Fully escalated ensemble', average['ensemble'], cascade['ensemble']
+    )
+
+def test_cascade_cost(X):
+    """Cascade skips most of the costlier model work and is faster than average"""
+    print("\nTesting cascade inference cost...")
+    config = cascade_config()
+    average_config = dict(backend.ENSEMBLE_CONFIG, mode='average')
+
+    def best_time_ms(score_config):
+        timings = []
+        for _ in range(COST_RUNS):
+            start = time.perf_counter()
+            backend.score_feature_matrix(X, score_config)
+            timings.append((time.perf_counter() - start) * 1000)
+        return min(timings)
+
+    average_ms = best_time_ms(average_config)
+    cascade_ms = best_time_ms(config)
+    escalated = escalated_mask(config, backend.score_feature_matrix(X, config))
+    print(f"Costlier model evaluations skipped: {1 - escalated.mean():.1%}")
+    print(f"Batch of {len(X)}: average {average_ms:.2f}ms, cascade {cascade_ms:.2f}ms "
+          f"({1 - cascade_ms / average_ms:.1%} saved)")
+    return escalated.mean() <= MAX_ESCALATED_FRACTION and cascade_ms < average_ms
+
+def test_cascade_rejects_zero_weight_screen():
+    """Cascade config with a zero-weight screen model is rejected"""
+    print("\nTesting cascade config validation...")
+    config = dict(backend.ENSEMBLE_CONFIG, mode='cascade')
+    screen_model = config['cascade']['screen_model']
+    config['models'] = dict(config['models'], **{
+        screen_model: dict(config['models'][screen_model], weight=0)
+    })
+    try:
+        backend.validate_ensemble_config(config)
+    except ValueError as e:
+        print(f"Rejected: {e}")
+        return True
+    return False
+
+def test_scoring_latency(df):
+    """Single-claim scoring p99 latency stays under target"""
+    print("\nTesting single-claim scoring latency...")
+    claims = df.sample(LATENCY_RUNS, replace=True, random_state=42).to_dict('records')
+    timings = []
+    for claim in claims:
+        start = time.perf_counter()
+        features = np.array([backend.claim_feature_vector(claim)], dtype=np.float64)
+        backend.score_feature_matrix(features)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    p50, p99 = np.percentile(timings, [50, 99])
+    print(f"p50: {p50:.2f}ms, p99: {p99:.2f}ms (target {LATENCY_P99_MS}ms)")
+    return p99 < LATENCY_P99_MS
+
+def main():
+    """Run all checks"""
+    print("Smart Claims Scoring Checks")
+    print("=" * 40)
+
+    df, X, X_scaled = train_on_synthetic_data()
+    tests = [
+        lambda: test_isolation_forest_parity(X_scaled),
+        lambda: test_xgboost_parity(X_scaled),
+        lambda: test_autoencoder_parity(X_scaled),
+        test_single_sample_forest,
+        lambda: test_cascade_escalation(X),
+        lambda: test_cascade_all_escalated(X),
+        lambda: test_cascade_cost(X),
+        test_cascade_rejects_zero_weight_screen,
+        lambda: test_scoring_latency(df),
+    ]
+
+    passed = 0
+    total = len(tests)
+
+    for test in tests:
+        try:
+            if test():
+                passed += 1
+                print("✅ PASSED")
+            else:
+                print("❌ FAILED")
+        except Exception as e:
+            print(f"❌ ERROR: {e}")
+
+    print("\n" + "=" * 40)
+    print(f"Test Results: {passed}/{total} tests passed")
+
+    if passed == total:
+        print("🎉 All tests passed!")
+    else:
+        print("⚠️  Some tests failed. Check the output above.")
+
+if __name__ == "__main__":
+    main()